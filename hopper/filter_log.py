@@ -0,0 +1,160 @@
+"""Extract unique error and warning lines from a FlashAttention-3 build log.
+
+Windows builds of the SM120 kernels produce very large ``install_log.txt`` files
+in which the same diagnostic is repeated once per instantiation. This script
+scans the log once and keeps the first occurrence of every ``error:`` and
+``warning:`` line (case-insensitive), writing each kind to its own file.
+Pass ``--expected-lines`` to bound memory on very large logs at the cost of
+approximate dedup.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import math
+import re
+from typing import Dict, Sequence
+
+DIAGNOSTIC_RE = re.compile(rb"(?i)(error|warning):")
+
+
+class DigestSet:
+    """Exact dedup on 8-byte BLAKE2b digests of each line."""
+
+    def __init__(self) -> None:
+        self._seen: set[bytes] = set()
+
+    def add(self, line: bytes) -> bool:
+        """Record ``line``; return True if it had not been seen before."""
+        digest = hashlib.blake2b(line, digest_size=8).digest()
+        if digest in self._seen:
+            return False
+        self._seen.add(digest)
+        return True
+
+
+class BloomFilter:
+    """Approximate dedup in a fixed-size bit array.
+
+    Memory stays constant regardless of log size. The price is that a small
+    fraction (about ``error_rate`` while fewer than ``capacity`` unique lines have
+    been added) of unique lines are mistaken for duplicates and dropped.
+    """
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def add(self, line: bytes) -> bool:
+        """Record ``line``; return True if it was (probably) not seen before."""
+        digest = hashlib.blake2b(line, digest_size=16).digest()
+        # Double hashing derives all probe positions from one digest.
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        added = False
+        for i in range(self.num_hashes):
+            bit = (h1 + i * h2) % self.num_bits
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            if not self._bits[byte] & mask:
+                self._bits[byte] |= mask
+                added = True
+        return added
+
+
+def filter_log(
+    input_file: str,
+    errors_file: str,
+    warnings_file: str,
+    *,
+    expected_lines: int | None = None,
+    error_rate: float = 1e-5,
+) -> Dict[str, int]:
+    """Split unique diagnostics into two files in one pass; return per-kind line counts.
+
+    When ``expected_lines`` is given, dedup uses a Bloom filter sized for that many
+    unique lines per kind instead of an exact digest set.
+    """
+    seen: Dict[bytes, DigestSet | BloomFilter] = {
+        kind: (
+            DigestSet()
+            if expected_lines is None
+            else BloomFilter(expected_lines, error_rate)
+        )
+        for kind in (b"error", b"warning")
+    }
+    counts = {kind: 0 for kind in seen}
+    with open(input_file, "rb") as fi, open(errors_file, "wb") as fe, open(
+        warnings_file, "wb"
+    ) as fw:
+        sinks = {b"error": fe, b"warning": fw}
+        for line in fi:
+            match = DIAGNOSTIC_RE.search(line)
+            if match is None:
+                continue
+            kind = match.group(1).lower()
+            if seen[kind].add(line):
+                counts[kind] += 1
+                sinks[kind].write(line)
+    return {kind.decode(): count for kind, count in counts.items()}
+
+
+def parse_args(argv: Sequence[str] | None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Extract unique error and warning lines from a FlashAttention-3 build log."
+    )
+    parser.add_argument(
+        "--input",
+        default="install_log.txt",
+        help="Build log to scan (default: install_log.txt).",
+    )
+    parser.add_argument(
+        "--errors",
+        default="errors_unique.txt",
+        help="Destination for unique error lines (default: errors_unique.txt).",
+    )
+    parser.add_argument(
+        "--warnings",
+        default="warning_unique.txt",
+        help="Destination for unique warning lines (default: warning_unique.txt).",
+    )
+    parser.add_argument(
+        "--expected-lines",
+        type=int,
+        default=None,
+        metavar="N",
+        help=(
+            "Dedup with a constant-memory Bloom filter sized for N unique lines per kind. "
+            "A small fraction of unique lines may be dropped; default: exact dedup."
+        ),
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=1e-5,
+        help="Target false-positive rate for --expected-lines (default: 1e-5).",
+    )
+    args = parser.parse_args(argv)
+    if args.expected_lines is not None and args.expected_lines <= 0:
+        parser.error("--expected-lines must be greater than 0")
+    if not 0 < args.error_rate < 1:
+        parser.error("--error-rate must be strictly between 0 and 1")
+    return args
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    args = parse_args(argv)
+    counts = filter_log(
+        args.input,
+        args.errors,
+        args.warnings,
+        expected_lines=args.expected_lines,
+        error_rate=args.error_rate,
+    )
+    print(f"Wrote {counts['error']} unique error lines to {args.errors}")
+    print(f"Wrote {counts['warning']} unique warning lines to {args.warnings}")
+
+
+if __name__ == "__main__":
+    main()
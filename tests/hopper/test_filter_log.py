@@ -0,0 +1,63 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "hopper"))
+
+from filter_log import filter_log, parse_args  # noqa: E402
+
+
+LOG_LINES = [
+    b"[1/3] nvcc -c flash_fwd_hdim64_fp16_sm120.cu\n",
+    b"tile_size.h(42): Warning: variable declared but never referenced\n",
+    b"flash_api.cpp(7): error: identifier undefined\n",
+    b"tile_size.h(42): Warning: variable declared but never referenced\n",
+    b"FLASH_API.CPP(7): ERROR: identifier undefined\n",
+    b"flash_api.cpp(7): error: identifier undefined\n",
+    b"ninja: build stopped: subcommand failed.\n",
+    b"link.exe: WARNING: ignoring /LTCG\n",
+]
+
+
+def _run(tmp_path: Path, **kwargs):
+    log = tmp_path / "install_log.txt"
+    log.write_bytes(b"".join(LOG_LINES))
+    errors = tmp_path / "errors_unique.txt"
+    warnings = tmp_path / "warning_unique.txt"
+    counts = filter_log(str(log), str(errors), str(warnings), **kwargs)
+    return counts, errors.read_bytes().splitlines(True), warnings.read_bytes().splitlines(True)
+
+
+@pytest.mark.parametrize("expected_lines", [None, 1000])
+def test_filter_log_splits_and_dedups(tmp_path, expected_lines):
+    counts, errors, warnings = _run(tmp_path, expected_lines=expected_lines)
+
+    # Matching is case-insensitive, dedup keeps the first occurrence of each exact
+    # line, and lines matching neither kind are dropped.
+    assert errors == [
+        b"flash_api.cpp(7): error: identifier undefined\n",
+        b"FLASH_API.CPP(7): ERROR: identifier undefined\n",
+    ]
+    assert warnings == [
+        b"tile_size.h(42): Warning: variable declared but never referenced\n",
+        b"link.exe: WARNING: ignoring /LTCG\n",
+    ]
+    assert counts == {"error": 2, "warning": 2}
+
+
+@pytest.mark.parametrize(
+    "argv",
+    [
+        ["--expected-lines", "0"],
+        ["--expected-lines", "-5"],
+        ["--error-rate", "0"],
+        ["--error-rate", "1"],
+        ["--error-rate", "1.5"],
+    ],
+)
+def test_parse_args_rejects_invalid_bloom_parameters(argv):
+    with pytest.raises(SystemExit):
+        parse_args(argv)
@@ -1,104 +1,145 @@
 import ctypes
+import hashlib
 import os
 import subprocess
 import sys
 import tempfile
 from pathlib import Path
 
+import numpy as np
+import pytest
+
 
 REPO_ROOT = Path(__file__).resolve().parents[2]
 SMEM_LIMIT_BYTES = 101_376
 
 
-def _build_tile_size_bridge(tmpdir: Path) -> Path:
-    src = tmpdir / "tile_size_bridge.cpp"
-    lib = tmpdir / "libtile_size_bridge.so"
-    src.write_text(
-        r'''
+BRIDGE_SOURCE = r'''
 #include <tuple>
 #include "hopper/tile_size.h"
 
-extern "C" void tile_size_fwd_sm90_bridge(
-        int headdim, int headdim_v, bool is_causal, bool is_local, int element_size,
-        bool v_colmajor, bool paged_kv_non_TMA, bool softcap,
-        int* block_m, int* block_n) {
-    auto result = tile_size_fwd_sm90(headdim, headdim_v, is_causal, is_local,
-                                     element_size, v_colmajor, paged_kv_non_TMA, softcap);
-    *block_m = std::get<0>(result);
-    *block_n = std::get<1>(result);
+// Walks the full (headdim, headdim_v, causal/local, paged) sweep in one call so
+// the test crosses the FFI boundary once. Outputs are laid out as
+// [n_hd][n_hdv][kMaskModes][2], with causal && local skipped as invalid.
+constexpr int kMaskModes = 3;
+
+extern "C" void tile_size_sweep(
+        const int* headdims, int n_hd, const int* headdims_v, int n_hdv, int element_size,
+        int* out_block_m, int* out_block_n) {
+    constexpr bool kCausal[kMaskModes] = {false, true, false};
+    constexpr bool kLocal[kMaskModes] = {false, false, true};
+    int i = 0;
+    for (int d = 0; d < n_hd; ++d) {
+        for (int dv = 0; dv < n_hdv; ++dv) {
+            for (int mode = 0; mode < kMaskModes; ++mode) {
+                for (int paged_kv_non_TMA = 0; paged_kv_non_TMA < 2; ++paged_kv_non_TMA) {
+                    auto result = tile_size_fwd_sm90(
+                        headdims[d], headdims_v[dv], kCausal[mode], kLocal[mode], element_size,
+                        /*v_colmajor=*/false, paged_kv_non_TMA != 0, /*softcap=*/false);
+                    out_block_m[i] = std::get<0>(result);
+                    out_block_n[i] = std::get<1>(result);
+                    ++i;
+                }
+            }
+        }
+    }
 }
-''',
-        encoding="utf-8",
-    )
-    compile_cmd = [
-        "g++",
-        "-std=c++20",
-        "-fPIC",
-        "-shared",
-        "-O2",
-        f"-I{REPO_ROOT}",
-        str(src),
-        "-o",
-        str(lib),
-    ]
-    subprocess.run(compile_cmd, check=True)
+'''
+
+
+def _build_tile_size_bridge(cache_dir: Path) -> Path:
+    # Key the cached library on everything that feeds the compile so edits to
+    # tile_size.h or the bridge invalidate it.
+    key = hashlib.sha256(
+        BRIDGE_SOURCE.encode("utf-8") + (REPO_ROOT / "hopper" / "tile_size.h").read_bytes()
+    ).hexdigest()[:16]
+    lib = cache_dir / f"libtile_size_bridge_{key}.so"
+    if lib.exists():
+        return lib
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=cache_dir) as td:
+        src = Path(td) / "tile_size_bridge.cpp"
+        tmp_lib = Path(td) / lib.name
+        src.write_text(BRIDGE_SOURCE, encoding="utf-8")
+        compile_cmd = [
+            "g++",
+            "-std=c++20",
+            "-fPIC",
+            "-shared",
+            "-O2",
+            f"-I{REPO_ROOT}",
+            str(src),
+            "-o",
+            str(tmp_lib),
+        ]
+        subprocess.run(compile_cmd, check=True)
+        os.replace(tmp_lib, lib)  # atomic, so concurrent sessions never load a partial file
     return lib
 
 
-def _load_bridge() -> ctypes.CDLL:
-    with tempfile.TemporaryDirectory() as td:
-        lib = _build_tile_size_bridge(Path(td))
-        return ctypes.CDLL(str(lib))
+@pytest.fixture(scope="session")
+def bridge(request, tmp_path_factory) -> ctypes.CDLL:
+    # Persist in pytest's per-checkout cache; fall back to a per-session
+    # directory when the cache provider is disabled (-p no:cacheprovider).
+    cache = getattr(request.config, "cache", None)
+    if cache is not None:
+        cache_dir = Path(cache.mkdir("fa3_tile_cache"))
+    else:
+        cache_dir = tmp_path_factory.mktemp("fa3_tile_cache")
+    return ctypes.CDLL(str(_build_tile_size_bridge(cache_dir)))
 
 
-def estimate_smem_bytes(block_m: int, block_n: int, headdim: int, headdim_v: int, element_size: int) -> int:
-    # Mirror the buffering-aware estimate used in hopper/tile_size.h.
-    buffering = 1 if (headdim_v >= 256 or headdim + headdim_v >= 512) else 2
+def estimate_smem_bytes(block_m, block_n, headdim, headdim_v, element_size: int):
+    # Mirror the buffering-aware estimate used in hopper/tile_size.h. Works on
+    # scalars or broadcastable NumPy arrays.
+    buffering = np.where((headdim_v >= 256) | (headdim + headdim_v >= 512), 1, 2)
     return buffering * (block_m + block_n) * (headdim + headdim_v) * element_size
 
 
-def test_tile_sizes_stay_within_blackwell_smem_budget():
-    bridge = _load_bridge()
-    bridge.tile_size_fwd_sm90_bridge.argtypes = [
+# (is_causal, is_local) in the order tile_size_sweep enumerates them.
+MASK_MODES = ((False, False), (True, False), (False, True))
+PAGED_MODES = (False, True)
+
+
+def test_tile_sizes_stay_within_blackwell_smem_budget(bridge):
+    int_ptr = ctypes.POINTER(ctypes.c_int)
+    bridge.tile_size_sweep.argtypes = [
+        int_ptr,
         ctypes.c_int,
+        int_ptr,
         ctypes.c_int,
-        ctypes.c_bool,
-        ctypes.c_bool,
         ctypes.c_int,
-        ctypes.c_bool,
-        ctypes.c_bool,
-        ctypes.c_bool,
-        ctypes.POINTER(ctypes.c_int),
-        ctypes.POINTER(ctypes.c_int),
+        int_ptr,
+        int_ptr,
     ]
+    bridge.tile_size_sweep.restype = None
+
+    head_dims = np.array((64, 96, 128, 160, 192, 256, 320), dtype=np.int32)
+    value_dims = np.array((64, 96, 128, 160, 192, 256, 512), dtype=np.int32)
+    shape = (len(head_dims), len(value_dims), len(MASK_MODES), len(PAGED_MODES))
+    block_m = np.empty(shape, dtype=np.int32)
+    block_n = np.empty_like(block_m)
+    bridge.tile_size_sweep(
+        head_dims.ctypes.data_as(int_ptr),
+        len(head_dims),
+        value_dims.ctypes.data_as(int_ptr),
+        len(value_dims),
+        2,  # fp16/bf16 element size
+        block_m.ctypes.data_as(int_ptr),
+        block_n.ctypes.data_as(int_ptr),
+    )
 
-    head_dims = (64, 96, 128, 160, 192, 256, 320)
-    value_dims = (64, 96, 128, 160, 192, 256, 512)
-    bools = (False, True)
-
-    for headdim in head_dims:
-        for headdim_v in value_dims:
-            for is_causal in bools:
-                for is_local in bools:
-                    if is_causal and is_local:
-                        continue  # invalid combination
-                    for paged_kv_non_tma in bools:
-                        block_m = ctypes.c_int()
-                        block_n = ctypes.c_int()
-                        bridge.tile_size_fwd_sm90_bridge(
-                            headdim,
-                            headdim_v,
-                            is_causal,
-                            is_local,
-                            2,  # fp16/bf16 element size
-                            False,  # v_colmajor
-                            paged_kv_non_tma,
-                            False,  # softcap
-                            ctypes.byref(block_m),
-                            ctypes.byref(block_n),
-                        )
-                        smem_bytes = estimate_smem_bytes(block_m.value, block_n.value, headdim, headdim_v, 2)
-                        assert smem_bytes <= SMEM_LIMIT_BYTES, (
-                            f"SMEM overrun for d={headdim}, dv={headdim_v}, causal={is_causal}, "
-                            f"local={is_local}, paged={paged_kv_non_tma}: {smem_bytes}B"
-                        )
+    smem_bytes = estimate_smem_bytes(
+        block_m,
+        block_n,
+        head_dims[:, None, None, None],
+        value_dims[None, :, None, None],
+        2,
+    )
+    overruns = [
+        f"d={head_dims[d]}, dv={value_dims[dv]}, causal={MASK_MODES[mode][0]}, "
+        f"local={MASK_MODES[mode][1]}, paged={PAGED_MODES[paged]}: {smem_bytes[d, dv, mode, paged]}B"
+        for d, dv, mode, paged in np.argwhere(smem_bytes > SMEM_LIMIT_BYTES)
+    ]
+    assert not overruns, "SMEM overrun for " + "; ".join(overruns)
@@ -1,20 +1,58 @@
+import mmap
+import os
 import pathlib
 import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 ROOT = pathlib.Path(__file__).resolve().parents[2]
-INCLUDE_RE = re.compile(r'#include\s+"([^"]+)"')
+INCLUDE_RE = re.compile(rb'#include\s+"([^"]+)"')
+SOURCE_SUFFIXES = (".h", ".hpp", ".cu")
+
+
+def walk_files(root: str):
+    """Yield every file path under root as a plain string, without following symlinks."""
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk_files(entry.path)
+            elif entry.is_file():
+                yield entry.path
+
+
+def path_key(path: str) -> str:
+    """Normalize a path for lookups; normcase folds case on case-insensitive Windows."""
+    return os.path.normcase(os.path.normpath(path))
+
+
+def find_includes(path: str) -> list[str]:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []  # mmap rejects empty files
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return [
+                m.group(1).decode("utf-8", "ignore") for m in INCLUDE_RE.finditer(mm)
+            ]
 
 
 def main() -> int:
+    all_paths = list(walk_files(str(ROOT)))
+    known = {path_key(path) for path in all_paths}
+    sources = sorted(path for path in all_paths if path.endswith(SOURCE_SUFFIXES))
+
     missing = []
-    for path in (*ROOT.rglob("*.h"), *ROOT.rglob("*.hpp"), *ROOT.rglob("*.cu")):
-        text = path.read_text(encoding="utf-8", errors="ignore")
-        for match in INCLUDE_RE.finditer(text):
-            include_path = match.group(1)
-            candidate = path.parent / include_path
-            if not candidate.exists():
-                missing.append(f"Missing include {include_path} referenced from {path}")
+    with ProcessPoolExecutor() as executor:
+        for path, includes in zip(
+            sources, executor.map(find_includes, sources, chunksize=32)
+        ):
+            for include_path in includes:
+                if (
+                    path_key(os.path.join(os.path.dirname(path), include_path))
+                    not in known
+                ):
+                    missing.append(
+                        f"Missing include {include_path} referenced from {path}"
+                    )
     if missing:
         for line in missing:
             print(line)
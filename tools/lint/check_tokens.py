@@ -1,26 +1,52 @@
 import pathlib
+import re
 import sys
 
 ROOT = pathlib.Path(__file__).resolve().parents[2]
 TARGETS = [ROOT / "hopper"]
 
-BRACKETS = {"{": "}", "[": "]", "(": ")"}
+BRACKETS = {ord("{"): ord("}"), ord("["): ord("]"), ord("("): ord(")")}
+
+# 256-entry lookup tables indexed by byte: KIND classifies a byte as neutral (0),
+# opening (1) or closing (2); MATCH holds the closing byte for each opener.
+NEUTRAL, OPEN, CLOSE = 0, 1, 2
+KIND = bytes(
+    OPEN if b in BRACKETS else CLOSE if b in BRACKETS.values() else NEUTRAL
+    for b in range(256)
+)
+MATCH = bytes(BRACKETS.get(b, 0) for b in range(256))
+
+# A single alternation so the regex engine skips ordinary source bytes in C and
+# only surfaces brackets plus the comments/literals that may hide them.
+TOKEN_RE = re.compile(
+    rb"//[^\n]*"
+    rb"|/\*.*?(?:\*/|\Z)"
+    rb'|R"([^()\\\s]{0,16})\(.*?\)\1"'
+    rb'|"(?:\\.|[^"\\\n])*"'
+    # Numbers first, so a C++14 digit separator (1'000) never opens a char literal.
+    rb"|(?<!\w)\d(?:[\w.]|'(?=\w))*" rb"|'(?:\\.|[^'\\\n])*'" rb"|[(){}\[\]]",
+    re.DOTALL,
+)
 
 
 def check_file(path: pathlib.Path) -> list[str]:
-    stack: list[str] = []
+    stack: list[int] = []
     problems: list[str] = []
-    text = path.read_text(encoding="utf-8", errors="ignore")
-    for idx, ch in enumerate(text):
-        if ch in BRACKETS:
-            stack.append(BRACKETS[ch])
-        elif ch in BRACKETS.values():
-            if not stack or stack[-1] != ch:
-                problems.append(f"{path}: unexpected token '{ch}' at offset {idx}")
-            elif stack:
-                stack.pop()
+    data = path.read_bytes()
+    for match in TOKEN_RE.finditer(data):
+        idx = match.start()
+        ch = data[idx]
+        kind = KIND[ch]
+        if kind == NEUTRAL:
+            continue  # comment or string/char literal
+        if kind == OPEN:
+            stack.append(MATCH[ch])
+        elif not stack or stack[-1] != ch:
+            problems.append(f"{path}: unexpected token '{chr(ch)}' at offset {idx}")
+        else:
+            stack.pop()
     if stack:
-        problems.append(f"{path}: unterminated tokens {stack}")
+        problems.append(f"{path}: unterminated tokens {[chr(ch) for ch in stack]}")
     return problems
 
 
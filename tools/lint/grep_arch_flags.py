@@ -1,20 +1,60 @@
+from __future__ import annotations
+
+import mmap
+import os
 import pathlib
 import re
+import shutil
+import subprocess
 import sys
 
 ROOT = pathlib.Path(__file__).resolve().parents[2]
 
-PATTERNS = [re.compile(r"sm_120"), re.compile(r"compute_120")]
+PATTERN = re.compile(rb"sm_120|compute_120")
 
 
-def main() -> int:
-    hits = 0
+def has_arch_flags_rg(rg: str) -> bool | None:
+    # --no-ignore/--hidden so rg scans the same files as the rglob fallback.
+    result = subprocess.run(
+        [
+            rg,
+            "-q",
+            "-F",
+            "--no-ignore",
+            "--hidden",
+            "-e",
+            "sm_120",
+            "-e",
+            "compute_120",
+            "-g",
+            "*setup.py",
+            str(ROOT),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    if result.returncode > 1:
+        return None  # rg failed; let the caller fall back to the Python scan
+    return result.returncode == 0
+
+
+def has_arch_flags() -> bool:
     for path in ROOT.rglob("*setup.py"):
-        text = path.read_text(encoding="utf-8", errors="ignore")
-        for pattern in PATTERNS:
-            if pattern.search(text):
-                hits += 1
-    if hits == 0:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                continue  # mmap rejects empty files
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if PATTERN.search(mm):
+                    return True
+    return False
+
+
+def main() -> int:
+    rg = shutil.which("rg")
+    found = has_arch_flags_rg(rg) if rg else None
+    if found is None:
+        found = has_arch_flags()
+    if not found:
         print("missing sm_120 flags in setup files")
         return 1
     print("arch flag check ok")